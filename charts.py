@@ -0,0 +1,68 @@
+import io
+from datetime import datetime
+
+# 📈 Отрисовка графиков давления. Выполняется в процессах пула, поэтому модуль
+# не зависит от main.py и не трогает бота, Firebase и данные пользователей.
+
+
+# Подгружает matplotlib заранее, чтобы первый график не ждал импорта
+def warm_up():
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+
+
+# Прореживание: средние по равным группам точек
+def downsample_points(points, max_points):
+    if len(points) <= max_points:
+        return points
+    step = len(points) / max_points
+    result = []
+    for i in range(max_points):
+        bucket = points[int(i * step):int((i + 1) * step)]
+        result.append(tuple(sum(values) / len(bucket) for values in zip(*bucket)))
+    return result
+
+
+# Точки: (timestamp, сист., диаст.), возвращает PNG
+def render_pressure_chart(points):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+
+    dates = [datetime.fromtimestamp(point[0]) for point in points]
+    sys_values = [point[1] for point in points]
+    dia_values = [point[2] for point in points]
+    pulse_values = [s - d for s, d in zip(sys_values, dia_values)]
+    marker = "o" if len(points) <= 60 else None
+
+    fig, (ax_pressure, ax_pulse) = plt.subplots(
+        2, 1, figsize=(10, 7), sharex=True, gridspec_kw={"height_ratios": [3, 1]}
+    )
+    top = max(max(sys_values) + 10, 190)
+    ax_pressure.axhspan(140, top, color="tab:red", alpha=0.08, label="Гипертензия (≥140/90)")
+    ax_pressure.axhspan(130, 140, color="tab:orange", alpha=0.08, label="Высокое нормальное")
+    ax_pressure.axhline(90, color="tab:red", linestyle="--", linewidth=0.8)
+    ax_pressure.axhline(60, color="tab:blue", linestyle="--", linewidth=0.8)
+    ax_pressure.plot(dates, sys_values, marker=marker, color="tab:red", label="Систолическое")
+    ax_pressure.plot(dates, dia_values, marker=marker, color="tab:blue", label="Диастолическое")
+    ax_pressure.set_ylim(min(min(dia_values) - 10, 50), top)
+    ax_pressure.set_ylabel("мм рт. ст.")
+    ax_pressure.set_title("Артериальное давление")
+    ax_pressure.legend(loc="upper left", fontsize=8)
+    ax_pressure.grid(alpha=0.3)
+
+    ax_pulse.axhspan(30, 50, color="tab:green", alpha=0.1, label="Норма 30-50")
+    ax_pulse.plot(dates, pulse_values, marker=marker, color="tab:purple", label="Пульсовое")
+    ax_pulse.set_ylabel("мм рт. ст.")
+    ax_pulse.legend(loc="upper left", fontsize=8)
+    ax_pulse.grid(alpha=0.3)
+    ax_pulse.xaxis.set_major_formatter(mdates.DateFormatter("%d.%m.%y"))
+    fig.autofmt_xdate()
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=100)
+    plt.close(fig)
+    return buffer.getvalue()
@@ -1,10 +1,11 @@
 import asyncio
 import logging
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 import firebase_admin
-from firebase_admin import credentials, db
+from firebase_admin import credentials, db, exceptions as firebase_exceptions
+from google.auth import exceptions as google_auth_exceptions
 from openai import OpenAI
 from dotenv import load_dotenv
 import pytz
@@ -12,6 +13,12 @@ import pandas as pd
 import tempfile
 import base64
 import json
+import statistics
+import io
+import sqlite3
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 
 from aiogram import Bot, Dispatcher, types
@@ -22,6 +29,11 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.exceptions import TelegramForbiddenError, TelegramConflictError
 
+import charts
+from models import (
+    DATE_FORMAT, PROFILE_FIELDS, MeasurementSeries, ReminderSettings, UserProfile, parse_pressure, to_minutes
+)
+
 
 print("🔄 Запускается бот...")
 
@@ -62,6 +74,33 @@ if not OPENAI_API_KEY:
 if not FIREBASE_URL:
     raise ValueError("❌ FIREBASE_URL не найден! Проверь .env файл.")
 
+# 🗜 Настройки сжатия истории
+RAW_HISTORY_DAYS = int(os.getenv("RAW_HISTORY_DAYS", "90"))  # сколько дней хранить сырые измерения
+COMPACTION_INTERVAL_HOURS = int(os.getenv("COMPACTION_INTERVAL_HOURS", "24"))
+ARCHIVE_COMPACTED = os.getenv("ARCHIVE_COMPACTED", "false").lower() in ("1", "true", "yes")
+
+# 📥 Настройки импорта
+IMPORT_BATCH_SIZE = 500  # измерений в одной записи в Firebase
+IMPORT_MAX_ROWS = 20000
+IMPORT_ERRORS_IN_MESSAGE = 20
+
+# 📈 Настройки графиков
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+CHART_QUEUE_SIZE = int(os.getenv("CHART_QUEUE_SIZE", "8"))  # сколько графиков может ждать отрисовки
+CHART_CACHE_SIZE = 128
+CHART_MAX_POINTS = 400  # больше точек на графике не различить
+
+# 📒 Локальный журнал изменений
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "journal.sqlite3")
+JOURNAL_RETRY_SECONDS = 5
+JOURNAL_MAX_RETRY_SECONDS = 300  # пауза между повторами растёт вдвое до этого предела
+
+# 🔄 Синхронизация с Firebase: listen — realtime-подписка, poll — опрос по ETag, off — выключена
+SYNC_MODE = os.getenv("SYNC_MODE", "listen").lower()
+SYNC_POLL_SECONDS = int(os.getenv("SYNC_POLL_SECONDS", "30"))
+SYNC_SNAPSHOT_TIMEOUT = 120  # сколько ждать первого снимка подписки, прежде чем загрузить данные целиком
+SYNCED_NODES = ("users", "measurements", "reminder_settings", "measurement_aggregates")
+
 # ⚙️ Инициализация Firebase
 firebase_key_b64 = os.getenv("FIREBASE_KEY_JSON_B64")
 firebase_key_json = json.loads(base64.b64decode(firebase_key_b64))
@@ -77,6 +116,11 @@ firebase_admin.initialize_app(cred, {
 # ⚙️ Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
+# 📈 Пул для графиков. Процессы форкаются сразу, пока нет ни потоков, ни журнала, ни загруженных данных:
+# fork многопоточного процесса может зависнуть, а spawn/forkserver заново выполнили бы main.py в каждом процессе
+chart_executor = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context("fork"))
+chart_executor.submit(charts.warm_up)
+
 # 🤖 Инициализация бота и диспетчера
 bot = Bot(token=API_TOKEN)
 storage = MemoryStorage()
@@ -111,6 +155,10 @@ class SetReminder(StatesGroup):
 class ChatWithAI(StatesGroup):
     active = State()
 
+# 📦 Состояние для импорта измерений из файла
+class ImportData(StatesGroup):
+    file = State()
+
 # Хранилище для истории переписки с ChatGPT (вопросы и ответы)
 chat_history = {}
 
@@ -119,38 +167,285 @@ def load_data():
     users_ref = db.reference('users')
     measurements_ref = db.reference('measurements')
     reminders_ref = db.reference('reminder_settings')
+    aggregates_ref = db.reference('measurement_aggregates')
 
     users_data = users_ref.get() or {}
     measurements_data = measurements_ref.get() or {}
     reminders_data = reminders_ref.get() or {}
+    aggregates_data = aggregates_ref.get() or {}
+
+    # Преобразуем ключи в int (Firebase хранит их как строки) и данные — в модели
+    users = load_records("users", users_data)
+    measurements = load_records("measurements", measurements_data)
+    reminder_settings = load_records("reminder_settings", reminders_data)
+    measurement_aggregates = load_records("measurement_aggregates", aggregates_data)
+
+    logging.info(f"Loaded users: {len(users)}")
+    logging.info(f"Loaded measurements: {sum(len(series) for series in measurements.values())}")
+    logging.info(f"Loaded reminder_settings: {len(reminder_settings)}")
+    logging.info(f"Loaded measurement_aggregates: {len(measurement_aggregates)}")
+
+    return users, measurements, reminder_settings, measurement_aggregates
+
+# 📒 Журнал изменений: каждое изменение сначала попадает в SQLite, потом в Firebase
+journal = sqlite3.connect(JOURNAL_PATH, isolation_level=None)
+journal.execute("PRAGMA journal_mode=WAL")
+journal.execute("PRAGMA synchronous=FULL")
+journal.execute(
+    "CREATE TABLE IF NOT EXISTS journal ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, path TEXT NOT NULL, value TEXT)"
+)
+# Изменения, которые Firebase так и не принял; разбираются вручную
+journal.execute(
+    "CREATE TABLE IF NOT EXISTS journal_failed ("
+    "id INTEGER PRIMARY KEY, op TEXT NOT NULL, path TEXT NOT NULL, value TEXT, error TEXT, failed_at TEXT)"
+)
+journal_event = asyncio.Event()
+journal_attempts = {}
+
+# Снимаются с очереди только явно постоянные ошибки; всё остальное (в том числе ошибки
+# обновления токена google.auth без сети) считается временным и повторяется бесконечно
+AUTH_TRANSPORT_ERRORS = (google_auth_exceptions.TransportError, google_auth_exceptions.RefreshError)
+PERMANENT_JOURNAL_ERRORS = (
+    ValueError,
+    TypeError,
+    firebase_exceptions.PermissionDeniedError,
+    firebase_exceptions.InvalidArgumentError,
+)
+
+# Записывает изменение в журнал; в Firebase его отправит journal_replayer
+def record_change(path, value, op="set"):
+    journal.execute(
+        "INSERT INTO journal (op, path, value) VALUES (?, ?, ?)",
+        (op, path, json.dumps(value, ensure_ascii=False))
+    )
+    journal_event.set()
+
+# Есть ли в журнале неотправленные изменения по пути (например, users/123)
+def has_pending_change(path):
+    return journal.execute(
+        "SELECT 1 FROM journal WHERE path = ? OR path LIKE ? LIMIT 1", (path, f"{path}/%")
+    ).fetchone() is not None
+
+def get_pending_changes(limit=100):
+    rows = journal.execute("SELECT id, op, path, value FROM journal ORDER BY id LIMIT ?", (limit,)).fetchall()
+    return [(change_id, op, path, json.loads(value)) for change_id, op, path, value in rows]
+
+# set и update идемпотентны, поэтому повторное применение записи безопасно
+def apply_change(op, path, value):
+    ref = db.reference(path)
+    if op == "update":
+        ref.update(value)
+    elif value is None or value == []:
+        ref.delete()
+    else:
+        ref.set(value)
+
+# Переносит запись в journal_failed, чтобы она не блокировала остальные
+def dead_letter_change(change_id, error):
+    journal.execute(
+        "INSERT OR REPLACE INTO journal_failed (id, op, path, value, error, failed_at) "
+        "SELECT id, op, path, value, ?, ? FROM journal WHERE id = ?",
+        (repr(error), datetime.now(TIMEZONE).isoformat(), change_id)
+    )
+    journal.execute("DELETE FROM journal WHERE id = ?", (change_id,))
+    journal_attempts.pop(change_id, None)
+
+def count_failed_changes():
+    return journal.execute("SELECT COUNT(*) FROM journal_failed").fetchone()[0]
+
+# Обработка ошибки отправки: True — запись снята с очереди, False — повторить позже
+def handle_change_failure(change_id, op, path, error):
+    attempts = journal_attempts[change_id] = journal_attempts.get(change_id, 0) + 1
+    if isinstance(error, PERMANENT_JOURNAL_ERRORS) and not isinstance(error, AUTH_TRANSPORT_ERRORS):
+        dead_letter_change(change_id, error)
+        logging.error(
+            f"🚨 Journal entry {change_id} ({op} {path}) rejected by Firebase, moved to journal_failed "
+            f"({count_failed_changes()} entries there now): {error}"
+        )
+        return True
+    logging.warning(f"Failed to apply journal entry {change_id} ({op} {path}), attempt {attempts}: {error}")
+    return False
+
+# Пауза перед повтором записи: удваивается с каждой неудачей, но не больше JOURNAL_MAX_RETRY_SECONDS
+def journal_retry_delay(change_id):
+    attempts = journal_attempts.get(change_id, 1)
+    return min(JOURNAL_RETRY_SECONDS * 2 ** min(attempts - 1, 16), JOURNAL_MAX_RETRY_SECONDS)
+
+# Синхронный прогон журнала при старте, до загрузки данных
+def replay_journal():
+    replayed = 0
+    while changes := get_pending_changes():
+        for change_id, op, path, value in changes:
+            try:
+                apply_change(op, path, value)
+            except Exception as e:
+                if handle_change_failure(change_id, op, path, e):
+                    continue
+                raise
+            journal.execute("DELETE FROM journal WHERE id = ?", (change_id,))
+            journal_attempts.pop(change_id, None)
+            replayed += 1
+    if replayed:
+        logging.info(f"Replayed {replayed} journal entries")
+
+# Фоновая отправка журнала в Firebase, строго по порядку
+async def journal_replayer():
+    logging.info("Starting journal replayer")
+    while True:
+        changes = get_pending_changes()
+        if not changes:
+            journal_event.clear()
+            await journal_event.wait()
+            continue
+        for change_id, op, path, value in changes:
+            try:
+                await asyncio.to_thread(apply_change, op, path, value)
+            except Exception as e:
+                if handle_change_failure(change_id, op, path, e):
+                    continue
+                await asyncio.sleep(journal_retry_delay(change_id))
+                break
+            journal.execute("DELETE FROM journal WHERE id = ?", (change_id,))
+            journal_attempts.pop(change_id, None)
+
+# 🧩 Применение изменения по пути Firebase к локальным словарям
+def _get_child(container, key):
+    if isinstance(container, list):
+        index = int(key)
+        return container[index] if index < len(container) else None
+    return container.get(key)
+
+def _put_child(container, key, value):
+    if isinstance(container, list):
+        index = int(key)
+        if value is None:
+            if index == len(container) - 1:
+                container.pop()
+            elif index < len(container):
+                container[index] = None
+            return
+        container.extend([None] * (index + 1 - len(container)))
+        container[index] = value
+    elif value is None:
+        container.pop(key, None)
+    else:
+        container[key] = value
+
+def get_cache(node):
+    return {
+        "users": users,
+        "measurements": measurements,
+        "reminder_settings": reminder_settings,
+        "measurement_aggregates": measurement_aggregates,
+    }.get(node)
+
+NODE_MODELS = {"users": UserProfile, "measurements": MeasurementSeries, "reminder_settings": ReminderSettings}
+
+def cache_from_json(node, data):
+    model = NODE_MODELS.get(node)
+    return model.from_json(data) if model else data
+
+# Записи узла -> {id: модель}; испорченная запись (например, правка в админке) пропускается
+def load_records(node, data):
+    records = {}
+    for key, value in (data or {}).items():
+        if value is None:
+            continue
+        try:
+            records[int(key)] = cache_from_json(node, value)
+        except Exception as e:
+            logging.error(f"🚨 Skipped unreadable record {node}/{key}: {e!r}")
+    return records
 
-    # Преобразуем ключи в int (Firebase хранит их как строки)
-    users = {int(k): v for k, v in users_data.items()}
-    measurements = {int(k): v for k, v in measurements_data.items()}
-    reminder_settings = {int(k): v for k, v in reminders_data.items()}
-
-    logging.info(f"Loaded users: {users}")
-    logging.info(f"Loaded measurements: {measurements}")
-    logging.info(f"Loaded reminder_settings: {reminder_settings}")
-
-    return users, measurements, reminder_settings
-
-# ⏳ Сохранение данных в Firebase
-def save_data(users, measurements, reminder_settings):
-    users_ref = db.reference('users')
-    measurements_ref = db.reference('measurements')
-    reminders_ref = db.reference('reminder_settings')
-
-    logging.info(f"Saving users: {users}")
-    logging.info(f"Saving measurements: {measurements}")
-    logging.info(f"Saving reminder_settings: {reminder_settings}")
+def cache_to_json(node, value):
+    return value.to_json() if node in NODE_MODELS else value
 
-    users_ref.set(users)
-    measurements_ref.set(measurements)
-    reminders_ref.set(reminder_settings)
+def apply_change_to_cache(op, path, value):
+    node, *keys = [part for part in path.split("/") if part]
+    cache = get_cache(node)
+    if cache is None or not keys:
+        return
+    user_id = keys[0] = int(keys[0])  # id пользователя хранится как int
+    # Частый случай — одно измерение по индексу, без пересборки всей серии
+    if node == "measurements" and op == "set" and len(keys) == 2 and value and user_id in cache:
+        series = cache[user_id]
+        if int(keys[1]) <= len(series):
+            series.set_entry(int(keys[1]), value)
+            return
+    # Остальное применяется к JSON-представлению пользователя
+    container = {user_id: cache_to_json(node, cache[user_id])} if user_id in cache else {}
+    root = container
+    for key in keys[:-1]:
+        child = _get_child(container, key)
+        if child is None:
+            child = {}
+            _put_child(container, key, child)
+        container = child
+    if op == "update":
+        target = _get_child(container, keys[-1])
+        if target is None:
+            target = {}
+            _put_child(container, keys[-1], target)
+        for key, child_value in value.items():
+            _put_child(target, key, child_value)
+    else:
+        _put_child(container, keys[-1], value)
+    if root.get(user_id):
+        cache[user_id] = cache_from_json(node, root[user_id])
+    else:
+        cache.pop(user_id, None)
+
+# ⏰ Индекс напоминаний: время "ЧЧ:ММ" -> id пользователей с активными напоминаниями
+reminder_index = {}
+reminder_times = {}
+
+def update_reminder_index(user_id):
+    for time in reminder_times.pop(user_id, ()):
+        reminder_index[time].discard(user_id)
+        if not reminder_index[time]:
+            del reminder_index[time]
+    settings = reminder_settings.get(user_id)
+    if settings and settings.active:
+        reminder_times[user_id] = settings.times
+        for time in settings.times:
+            reminder_index.setdefault(time, set()).add(user_id)
+
+def rebuild_reminder_index():
+    reminder_index.clear()
+    reminder_times.clear()
+    for user_id in reminder_settings:
+        update_reminder_index(user_id)
+
+# Заполнение кэшей: из load_data() или из снимков синхронизации (см. start_sync)
+def load_node_snapshot(node, data):
+    cache = get_cache(node)
+    cache.clear()
+    cache.update(load_records(node, data))
+
+# То, что не удалось отправить, накладываем на загруженные данные
+def finish_cache_load():
+    for _, op, path, value in get_pending_changes(limit=-1):
+        apply_change_to_cache(op, path, value)
+    rebuild_reminder_index()
+
+def fill_caches(loaded):
+    for cache, data in zip((users, measurements, reminder_settings, measurement_aggregates), loaded):
+        cache.clear()
+        cache.update(data)
+    finish_cache_load()
 
 # Загружаем данные при старте
-users, measurements, reminder_settings = load_data()
+try:
+    replay_journal()
+except Exception as e:
+    logging.error(f"Failed to replay journal on startup: {e}")
+if failed_changes := count_failed_changes():
+    logging.error(f"🚨 {failed_changes} journal entries were rejected by Firebase and wait in journal_failed")
+users, measurements, reminder_settings, measurement_aggregates = {}, {}, {}, {}
+if SYNC_MODE not in ("listen", "poll"):
+    # Без синхронизации данные загружаются целиком; иначе кэши заполнит start_sync
+    fill_caches(load_data())
 
 # 📋 Главное меню
 def get_main_menu():
@@ -160,7 +455,9 @@ def get_main_menu():
             [KeyboardButton(text="Установить напоминания")],
             [KeyboardButton(text="Выключить напоминания")],
             [KeyboardButton(text="Показать историю")],
+            [KeyboardButton(text="График")],
             [KeyboardButton(text="Экспорт данных")],
+            [KeyboardButton(text="Импорт данных")],
             [KeyboardButton(text="Редактировать профиль")],
             [KeyboardButton(text="Начать диалог с ИИ")],
         ],
@@ -191,73 +488,398 @@ def get_edit_profile_menu():
         resize_keyboard=True
     )
 
-# Генерация промпта для анализа ChatGPT с пульсовым давлением и динамикой (в стиле кардиолога)
-def generate_analysis_prompt(user, current, history):
-    name = user["name"]
-    age = user["age"]
-    gender = user["gender"]
-    height = user["height"]
-    weight = user["weight"]
-
-    # Вычисляем пульсовое давление
-    sys_first, dia_first = map(int, current['first'].split('/'))
-    sys_second, dia_second = map(int, current['second'].split('/'))
-    pulse_pressure_first = sys_first - dia_first
-    pulse_pressure_second = sys_second - dia_second
-
-    # Средние значения за историю
-    if history:
-        sys_values = [int(entry['first'].split('/')[0]) for entry in history]
-        dia_values = [int(entry['first'].split('/')[1]) for entry in history]
-        avg_sys = sum(sys_values) / len(sys_values)
-        avg_dia = sum(dia_values) / len(dia_values)
-        trend = "стабильное"
-        if len(history) > 1:
-            if sys_values[-1] > sys_values[-2]:
-                trend = "повышающееся"
-            elif sys_values[-1] < sys_values[-2]:
-                trend = "понижающееся"
-    else:
-        avg_sys, avg_dia, trend = "нет данных", "нет данных", "нет данных"
+# 📊 Локальный анализ давления (без ChatGPT)
+PULSE_PRESSURE_NORM = (30, 50)
+HOME_HYPERTENSION_THRESHOLD = (135, 85)  # порог для домашних измерений
+PAIR_DIFF_ALERT = 10  # допустимая разница между первым и вторым замером, мм рт. ст.
+SYS_VARIABILITY_ALERT = 15  # стандартное отклонение систолического, мм рт. ст.
+MORNING_SURGE_ALERT = 15  # превышение утреннего систолического над вечерним
+TREND_THRESHOLD = 5  # изменение среднего систолического за неделю, мм рт. ст.
 
-    history_lines = "\n".join(
-        f"{entry['date']} — Первое: {entry['first']}, Второе: {entry['second']}"
-        for entry in history[-10:]
-    )
+# Проверка введённого давления: возвращает текст ошибки или None
+def check_pressure(pressure):
+    if not re.match(r"^\d{2,3}/\d{2,3}$", pressure):
+        return "Неверный формат! Введи, например, 120/80."
+    sys, dia = parse_pressure(pressure)
+    if not (50 <= sys <= 300 and 30 <= dia <= 200):
+        return "Значения должны быть в пределах: систолическое 50-300, диастолическое 30-200."
+    return None
+
+# Категория по классификации ESC/ESH (оценивается по худшему из двух показателей)
+def classify_pressure(sys, dia):
+    if sys >= 180 or dia >= 110:
+        return "артериальная гипертензия 3 степени"
+    if sys >= 160 or dia >= 100:
+        return "артериальная гипертензия 2 степени"
+    if sys >= 140 or dia >= 90:
+        return "артериальная гипертензия 1 степени"
+    if sys < 90 or dia < 60:
+        return "гипотония"
+    if sys >= 130 or dia >= 85:
+        return "высокое нормальное"
+    if sys >= 120 or dia >= 80:
+        return "нормальное"
+    return "оптимальное"
+
+def is_hypertension(category):
+    return category.startswith("артериальная гипертензия")
+
+# Предупреждение о высоком давлении по одному замеру, или None
+def get_pressure_warning(sys, dia):
+    category = classify_pressure(sys, dia)
+    if is_hypertension(category):
+        return f"⚠️ Внимание: Ваше давление выше нормы (от 140/90) — {category}. Рекомендуем обратиться к врачу."
+    return None
+
+def _average_pressure(readings):
+    if not readings:
+        return None
+    return {
+        "sys": round(statistics.mean(r[1] for r in readings)),
+        "dia": round(statistics.mean(r[2] for r in readings)),
+        "count": len(readings),
+    }
+
+# Общее среднее с учётом помесячных агрегатов старой истории
+def _combine_with_aggregates(average, aggregates):
+    count = sum(a["count"] for a in aggregates.values())
+    if not count:
+        return average
+    sys_total = sum(a["sys_mean"] * a["count"] for a in aggregates.values())
+    dia_total = sum(a["dia_mean"] * a["count"] for a in aggregates.values())
+    if average:
+        sys_total += average["sys"] * average["count"]
+        dia_total += average["dia"] * average["count"]
+        count += average["count"]
+    return {"sys": round(sys_total / count), "dia": round(dia_total / count), "count": count}
+
+def analyze_measurements(series, aggregates=None, now=None):
+    readings = list(series.readings())
+    if not readings:
+        return None
+    if now is None:
+        now = datetime.now(TIMEZONE).replace(tzinfo=None)
+
+    last_date, last_sys, last_dia, pair_diff_sys, pair_diff_dia = readings[-1]
+    last_sys, last_dia = round(last_sys), round(last_dia)
+    summary = {
+        "count": len(readings),
+        "last": {
+            "sys": last_sys,
+            "dia": last_dia,
+            "pulse": last_sys - last_dia,
+            "category": classify_pressure(last_sys, last_dia),
+            "pair_diff": (pair_diff_sys, pair_diff_dia),
+        },
+        "average": _combine_with_aggregates(_average_pressure(readings), aggregates or {}),
+        "morning": _average_pressure([r for r in readings if 4 <= r[0].hour < 12]),
+        "evening": _average_pressure([r for r in readings if r[0].hour >= 18]),
+        "week": _average_pressure([r for r in readings if (now - r[0]).days < 7]),
+        "prev_week": _average_pressure([r for r in readings if 7 <= (now - r[0]).days < 14]),
+        "month": _average_pressure([r for r in readings if (now - r[0]).days < 30]),
+        "variability": None,
+        "trend": "нет данных",
+        "alerts": [],
+    }
 
+    if len(readings) >= 3:
+        sys_values = [r[1] for r in readings[-30:]]
+        summary["variability"] = {
+            "sd_sys": round(statistics.pstdev(sys_values), 1),
+            "sd_dia": round(statistics.pstdev(r[2] for r in readings[-30:]), 1),
+            "arv_sys": round(statistics.mean(abs(b - a) for a, b in zip(sys_values, sys_values[1:])), 1),
+        }
+
+    week, prev_week = summary["week"], summary["prev_week"]
+    if week and prev_week:
+        delta = week["sys"] - prev_week["sys"]
+        if delta >= TREND_THRESHOLD:
+            summary["trend"] = "повышающееся"
+        elif delta <= -TREND_THRESHOLD:
+            summary["trend"] = "понижающееся"
+        else:
+            summary["trend"] = "стабильное"
+
+    alerts = summary["alerts"]
+    if last_sys >= 180 or last_dia >= 110:
+        alerts.append("Очень высокое давление (≥180/110). При плохом самочувствии срочно обратись за медицинской помощью.")
+    elif last_sys < 90 or last_dia < 60:
+        alerts.append("Давление ниже 90/60. Если есть слабость или головокружение — обратись к врачу.")
+    if max(pair_diff_sys, pair_diff_dia) > PAIR_DIFF_ALERT:
+        alerts.append(f"Большая разница между замерами (более {PAIR_DIFF_ALERT} мм рт. ст.) — измеряй в покое, сидя, через 2-3 минуты.")
+    pulse_low, pulse_high = PULSE_PRESSURE_NORM
+    if not pulse_low <= summary["last"]["pulse"] <= pulse_high:
+        alerts.append(f"Пульсовое давление {summary['last']['pulse']} мм рт. ст. вне нормы ({pulse_low}-{pulse_high}).")
+    home_sys, home_dia = HOME_HYPERTENSION_THRESHOLD
+    if week and week["count"] >= 3 and (week["sys"] >= home_sys or week["dia"] >= home_dia):
+        alerts.append(f"Среднее за 7 дней {week['sys']}/{week['dia']} — выше порога для домашних измерений ({home_sys}/{home_dia}).")
+    morning, evening = summary["morning"], summary["evening"]
+    if morning and evening and morning["sys"] - evening["sys"] >= MORNING_SURGE_ALERT:
+        alerts.append("Утреннее давление заметно выше вечернего — обсуди это с врачом.")
+    variability = summary["variability"]
+    if variability and variability["sd_sys"] > SYS_VARIABILITY_ALERT:
+        alerts.append("Высокая вариабельность систолического давления.")
+    return summary
+
+def _format_average(average):
+    return f"{average['sys']}/{average['dia']} ({average['count']} изм.)" if average else "нет данных"
+
+# Краткая сводка для пользователя
+def format_analysis_summary(summary):
+    last = summary["last"]
+    lines = [
+        "📊 Сводка по давлению:",
+        f"Сейчас (среднее двух замеров): {last['sys']}/{last['dia']} — {last['category']}",
+        f"Пульсовое давление: {last['pulse']} мм рт. ст.",
+        f"Среднее за 7 дней: {_format_average(summary['week'])}",
+        f"Среднее за 30 дней: {_format_average(summary['month'])}",
+        f"Утро / вечер: {_format_average(summary['morning'])} / {_format_average(summary['evening'])}",
+        f"Динамика: {summary['trend']}",
+    ]
+    if summary["variability"]:
+        lines.append(f"Вариабельность (SD систолического): {summary['variability']['sd_sys']} мм рт. ст.")
+    lines.extend(f"⚠️ {alert}" for alert in summary["alerts"])
+    return "\n".join(lines)
+
+# Генерация промпта для анализа ChatGPT по готовой сводке (в стиле кардиолога)
+def generate_analysis_prompt(user, summary):
+    last = summary["last"]
+    variability = summary["variability"]
     prompt = (
-        f"Я — твой личный кардиолог. Давай разберём твои показатели артериального давления, {name}.\n\n"
-        f"Твои данные: возраст {age} лет, пол: {gender}, рост {height} см, вес {weight} кг.\n"
-        f"Текущие измерения:\n"
-        f"Первое измерение: {current['first']} (пульсовое давление: {pulse_pressure_first} мм рт. ст.)\n"
-        f"Второе измерение: {current['second']} (пульсовое давление: {pulse_pressure_second} мм рт. ст.)\n\n"
-        f"Средние значения по твоей истории:\n"
-        f"Среднее систолическое: {avg_sys}\n"
-        f"Среднее диастолическое: {avg_dia}\n"
-        f"Динамика давления: {trend}\n\n"
-        f"История измерений:\n{history_lines or 'Истории измерений пока нет.'}\n\n"
-        f"Давай проанализируем твои показатели:\n"
-        f"- Проверим, есть ли признаки гипертонии (давление выше 140/90) или гипотонии (давление ниже 90/60).\n"
-        f"- Оценим пульсовое давление (норма 30-50 мм рт. ст.) и разницу между первым и вторым замером.\n"
-        f"- Посмотрим на динамику твоих показателей.\n"
-        f"После анализа я дам рекомендации по образу жизни или диете, которые могут помочь.\n\n"
-        f"❗️Важно: Я не ставлю диагнозы. Если что-то вызывает беспокойство, рекомендую обратиться к врачу для очной консультации."
+        f"Ты — кардиолог. Пациент: {user.name}, {user.age} лет, пол {user.gender}, "
+        f"рост {user.height} см, вес {user.weight} кг.\n"
+        f"Сводка домашних измерений АД (уже рассчитана, пересчитывать не нужно):\n"
+        f"- текущее (среднее двух замеров): {last['sys']}/{last['dia']}, категория: {last['category']}, "
+        f"пульсовое {last['pulse']}, разница замеров {last['pair_diff'][0]}/{last['pair_diff'][1]}\n"
+        f"- среднее 7 дн: {_format_average(summary['week'])}; 30 дн: {_format_average(summary['month'])}; "
+        f"всего: {_format_average(summary['average'])}\n"
+        f"- утро: {_format_average(summary['morning'])}; вечер: {_format_average(summary['evening'])}\n"
+        f"- динамика за неделю: {summary['trend']}\n"
+    )
+    if variability:
+        prompt += f"- вариабельность: SD {variability['sd_sys']}/{variability['sd_dia']}, ARV сист. {variability['arv_sys']}\n"
+    if summary["alerts"]:
+        prompt += "- замечания: " + " ".join(summary["alerts"]) + "\n"
+    prompt += (
+        "\nДай короткую интерпретацию и рекомендации по образу жизни и питанию, обращаясь к пациенту на «ты». "
+        "Не ставь диагнозы и при тревожных показателях советуй очную консультацию врача."
     )
     return prompt
 
+# 🗜 Сжатие истории: старые измерения сворачиваются в помесячные агрегаты
+def _merge_month_aggregate(aggregate, readings):
+    count = len(readings)
+    sys_values = [r[1] for r in readings]
+    dia_values = [r[2] for r in readings]
+    merged = {
+        "count": count,
+        "sys_mean": sum(sys_values) / count,
+        "dia_mean": sum(dia_values) / count,
+        "pulse_pressure_mean": sum(s - d for s, d in zip(sys_values, dia_values)) / count,
+        "sys_min": min(sys_values),
+        "sys_max": max(sys_values),
+        "dia_min": min(dia_values),
+        "dia_max": max(dia_values),
+    }
+    if aggregate:
+        total = aggregate["count"] + count
+        for key in ("sys_mean", "dia_mean", "pulse_pressure_mean"):
+            merged[key] = (aggregate[key] * aggregate["count"] + merged[key] * count) / total
+        for key in ("sys_min", "dia_min"):
+            merged[key] = min(aggregate[key], merged[key])
+        for key in ("sys_max", "dia_max"):
+            merged[key] = max(aggregate[key], merged[key])
+        merged["count"] = total
+    for key in ("sys_mean", "dia_mean", "pulse_pressure_mean"):
+        merged[key] = round(merged[key], 1)
+    return merged
+
+# Возвращает (оставшиеся измерения, обновлённые агрегаты, свёрнутые измерения)
+def compact_measurements(series, aggregates, cutoff):
+    archived, kept = series.split_before(cutoff)
+    by_month = {}
+    for reading in archived.readings():
+        by_month.setdefault(reading[0].strftime("%Y-%m"), []).append(reading)
+    aggregates = dict(aggregates)
+    for month, readings in by_month.items():
+        aggregates[month] = _merge_month_aggregate(aggregates.get(month), readings)
+    return kept, aggregates, archived
+
+def compact_user_history(user_id, now=None):
+    if now is None:
+        now = datetime.now(TIMEZONE).replace(tzinfo=None)
+    cutoff = now - timedelta(days=RAW_HISTORY_DAYS)
+    kept, aggregates, archived = compact_measurements(
+        measurements.get(user_id, MeasurementSeries()), measurement_aggregates.get(user_id, {}), cutoff
+    )
+    if not archived:
+        return 0
+    if ARCHIVE_COMPACTED:
+        record_change(f"measurement_archive/{user_id}", {
+            f"{archived.date(i).strftime('%Y%m%d%H%M')}_{i}": archived.entry(i)
+            for i in range(len(archived))
+        }, op="update")
+    measurements[user_id] = kept
+    measurement_aggregates[user_id] = aggregates
+    record_change(f"measurement_aggregates/{user_id}", aggregates)
+    record_change(f"measurements/{user_id}", kept.to_json())
+    logging.info(f"Compacted {len(archived)} measurements of user {user_id} into {len(aggregates)} monthly aggregates")
+    return len(archived)
+
+# Фоновое сжатие истории всех пользователей
+async def compaction_loop():
+    logging.info(f"Starting compaction loop (raw history: {RAW_HISTORY_DAYS} days)")
+    while True:
+        for user_id in list(measurements):
+            try:
+                compact_user_history(user_id)
+            except Exception as e:
+                logging.error(f"Failed to compact history of user {user_id}: {e}")
+            await asyncio.sleep(0)
+        await asyncio.sleep(COMPACTION_INTERVAL_HOURS * 3600)
+
+def format_month(month):
+    year, month_number = month.split("-")
+    return f"{month_number}.{year}"
+
+# 📥 Импорт измерений из CSV/XLSX
+IMPORT_COLUMNS = {
+    "date": "date", "дата": "date",
+    "first": "first", "первое": "first",
+    "second": "second", "второе": "second",
+}
+IMPORT_DATE_FORMATS = (DATE_FORMAT, "%d.%m.%Y %H:%M:%S", "%d.%m.%Y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+def _parse_import_date(value):
+    if isinstance(value, datetime):  # pd.Timestamp тоже datetime
+        return value.replace(tzinfo=None)
+    value = str(value).strip()
+    for date_format in IMPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    return None
+
+def _import_cell(value):
+    if value is None or (isinstance(value, float) and value != value):  # пустая ячейка / NaN
+        return ""
+    return str(value).strip()
+
+# Разбор файла (выполняется в отдельном потоке): возвращает (новые измерения, ошибки по строкам)
+# existing_dates — даты уже сохранённых измерений в минутах (см. models.to_minutes),
+# closed_months — свёрнутые месяцы, в которые нельзя добавлять измерения старше cutoff
+def parse_import_file(content, filename, existing_dates, closed_months, cutoff, now):
+    if filename.lower().endswith(".csv"):
+        df = pd.read_csv(io.BytesIO(content), dtype=str, keep_default_na=False, sep=None, engine="python")
+    else:
+        df = pd.read_excel(io.BytesIO(content), dtype=object)
+    df = df.rename(columns=lambda column: IMPORT_COLUMNS.get(str(column).strip().lower(), column))
+    if "date" not in df.columns or "first" not in df.columns:
+        raise ValueError("В файле нужны колонки date и first (или «Дата» и «Первое»).")
+    if len(df) > IMPORT_MAX_ROWS:
+        raise ValueError(f"Слишком много строк: {len(df)}. Максимум — {IMPORT_MAX_ROWS}.")
+    has_second = "second" in df.columns
+
+    accepted, errors = MeasurementSeries(), []
+    seen_dates = set(existing_dates)
+    for row_number, row in enumerate(df.to_dict("records"), start=2):  # строка 1 — заголовок
+        date = _parse_import_date(row["date"])
+        if date is None:
+            errors.append(f"Строка {row_number}: не удалось распознать дату «{_import_cell(row['date'])}».")
+            continue
+        if date > now:
+            errors.append(f"Строка {row_number}: дата {date.strftime(DATE_FORMAT)} в будущем.")
+            continue
+        first = _import_cell(row["first"])
+        second = _import_cell(row["second"]) if has_second else ""
+        second = second or first  # в бумажных дневниках часто одно измерение
+        error = check_pressure(first) or check_pressure(second)
+        if error:
+            errors.append(f"Строка {row_number}: {error}")
+            continue
+        date_key = to_minutes(date)
+        if date_key in seen_dates:
+            errors.append(f"Строка {row_number}: измерение от {date.strftime(DATE_FORMAT)} уже есть, пропущено.")
+            continue
+        if date < cutoff and date.strftime("%Y-%m") in closed_months:
+            errors.append(f"Строка {row_number}: {format_month(date.strftime('%Y-%m'))} уже свёрнут в помесячную статистику.")
+            continue
+        seen_dates.add(date_key)
+        accepted.append(date, parse_pressure(first), parse_pressure(second))
+    return accepted, errors
+
+# Даты уже сохранённых измерений (включая архив) и месяцы, которые нельзя дополнить
+def get_import_conflicts(user_id):
+    existing_dates = measurements.get(user_id, MeasurementSeries()).valid_timestamps()
+    closed_months = set()
+    if ARCHIVE_COMPACTED:
+        archive_keys = db.reference(f'measurement_archive/{user_id}').get(shallow=True) or {}
+        for key in archive_keys:
+            existing_dates.add(to_minutes(datetime.strptime(key.split("_")[0], "%Y%m%d%H%M")))
+    else:
+        closed_months = set(measurement_aggregates.get(user_id, {}))
+    return existing_dates, closed_months
+
+# 📈 Графики давления
+chart_slots = asyncio.Semaphore(CHART_WORKERS + CHART_QUEUE_SIZE)
+chart_cache = OrderedDict()
+chart_pending = {}
+
+# Точки графика: (timestamp, сист., диаст.) — помесячные агрегаты и усреднённые пары замеров
+def get_chart_points(user_id):
+    points = []
+    for month, aggregate in sorted(measurement_aggregates.get(user_id, {}).items()):
+        middle = datetime.strptime(month, "%Y-%m") + timedelta(days=14)
+        points.append((middle.timestamp(), aggregate["sys_mean"], aggregate["dia_mean"]))
+    for reading in measurements.get(user_id, MeasurementSeries()).readings():
+        points.append((reading[0].timestamp(), reading[1], reading[2]))
+    points.sort()
+    return points
+
+# Возвращает PNG из кэша или рисует его в пуле; None — если очередь переполнена
+async def get_pressure_chart(user_id):
+    series = measurements.get(user_id, MeasurementSeries())
+    key = (
+        user_id,
+        len(series),
+        sum(a["count"] for a in measurement_aggregates.get(user_id, {}).values()),
+        series.timestamps[-1] if len(series) else None,
+    )
+    if key in chart_cache:
+        chart_cache.move_to_end(key)
+        return chart_cache[key]
+    if key in chart_pending:
+        return await asyncio.shield(chart_pending[key])
+    if chart_slots.locked():
+        return None
+
+    points = charts.downsample_points(get_chart_points(user_id), CHART_MAX_POINTS)
+    async with chart_slots:
+        future = asyncio.get_running_loop().run_in_executor(chart_executor, charts.render_pressure_chart, points)
+        chart_pending[key] = future
+        try:
+            png = await future
+        finally:
+            chart_pending.pop(key, None)
+    chart_cache[key] = png
+    while len(chart_cache) > CHART_CACHE_SIZE:
+        chart_cache.popitem(last=False)
+    return png
+
 # Генерация промпта для диалога с ИИ (в стиле кардиолога)
 def generate_chat_prompt(user_id, question):
-    user = users.get(user_id, {})
-    user_measurements = measurements.get(user_id, [])
-    name = user.get("name", "Неизвестно")
-    age = user.get("age", "Неизвестно")
-    gender = user.get("gender", "Неизвестно")
-    height = user.get("height", "Неизвестно")
-    weight = user.get("weight", "Неизвестно")
+    user = users.get(user_id)
+    user_measurements = measurements.get(user_id, MeasurementSeries())
+    name = user.name if user else "Неизвестно"
+    age = user.age if user else "Неизвестно"
+    gender = user.gender if user else "Неизвестно"
+    height = user.height if user else "Неизвестно"
+    weight = user.weight if user else "Неизвестно"
 
     history_lines = "\n".join(
         f"{entry['date']} — Первое: {entry['first']}, Второе: {entry['second']}"
-        for entry in user_measurements[-10:]
+        for entry in user_measurements.entries(-10)
     )
 
     # Получаем историю переписки
@@ -291,7 +913,7 @@ async def start_command(message: types.Message, state: FSMContext):
             await message.answer("Привет! Как тебя зовут?")
             await state.set_state(Registration.name)
         else:
-            await message.answer(f"Привет, {users[user_id]['name']}! Что делаем? ❤️", reply_markup=get_main_menu())
+            await message.answer(f"Привет, {users[user_id].name}! Что делаем? ❤️", reply_markup=get_main_menu())
     except TelegramForbiddenError:
         logging.warning(f"Bot was blocked by user {user_id}")
 
@@ -377,10 +999,10 @@ async def process_weight(message: types.Message, state: FSMContext):
     user_data = await state.get_data()
     user_data["weight"] = weight
     user_id = message.from_user.id
-    users[user_id] = user_data
-    measurements[user_id] = measurements.get(user_id, [])
-    # Сохраняем данные в Firebase
-    save_data(users, measurements, reminder_settings)
+    users[user_id] = UserProfile(**user_data)
+    measurements.setdefault(user_id, MeasurementSeries())
+    # Сохраняем данные (журнал → Firebase)
+    record_change(f"users/{user_id}", users[user_id].to_json())
     try:
         await message.answer(
             f"Готово, {user_data['name']}! Твои данные: возраст {user_data['age']}, пол {user_data['gender']}, "
@@ -412,19 +1034,15 @@ async def measure_pressure(message: types.Message, state: FSMContext):
 @dp.message(PressureMeasurement.first_measurement)
 async def process_first_measurement(message: types.Message, state: FSMContext):
     pressure = message.text.strip()
-    if not re.match(r"^\d{2,3}/\d{2,3}$", pressure):
-        await message.answer("Неверный формат! Введи, например, 120/80.")
-        return
-    try:
-        sys, dia = map(int, pressure.split("/"))
-        if not (50 <= sys <= 300 and 30 <= dia <= 200):
-            raise ValueError
-    except ValueError:
-        await message.answer("Значения должны быть в пределах: систолическое 50-300, диастолическое 30-200.")
+    error = check_pressure(pressure)
+    if error:
+        await message.answer(error)
         return
+    sys, dia = parse_pressure(pressure)
     # Проверяем на высокое давление
-    if sys > 140 or dia > 90:
-        await message.answer("⚠️ Внимание: Ваше давление выше нормы (140/90). Рекомендуем обратиться к врачу.")
+    warning = get_pressure_warning(sys, dia)
+    if warning:
+        await message.answer(warning)
     await state.update_data(first_measurement=pressure)
     try:
         await message.answer("Хорошо, через 2-3 минуты измерь еще раз и запиши результат.")
@@ -436,37 +1054,30 @@ async def process_first_measurement(message: types.Message, state: FSMContext):
 @dp.message(PressureMeasurement.second_measurement)
 async def process_second_measurement(message: types.Message, state: FSMContext):
     pressure = message.text.strip()
-    if not re.match(r"^\d{2,3}/\d{2,3}$", pressure):
-        await message.answer("Неверный формат! Введи, например, 120/80.")
-        return
-    try:
-        sys, dia = map(int, pressure.split("/"))
-        if not (50 <= sys <= 300 and 30 <= dia <= 200):
-            raise ValueError
-    except ValueError:
-        await message.answer("Значения должны быть в пределах: систолическое 50-300, диастолическое 30-200.")
+    error = check_pressure(pressure)
+    if error:
+        await message.answer(error)
         return
+    sys, dia = parse_pressure(pressure)
     # Проверяем на высокое давление
-    if sys > 140 or dia > 90:
-        await message.answer("⚠️ Внимание: Ваше давление выше нормы (140/90). Рекомендуем обратиться к врачу.")
+    warning = get_pressure_warning(sys, dia)
+    if warning:
+        await message.answer(warning)
     user_id = message.from_user.id
     user_data = await state.get_data()
     first = user_data["first_measurement"]
-    entry = {
-        "date": datetime.now(TIMEZONE).strftime("%d.%m.%Y %H:%M"),
-        "first": first,
-        "second": pressure,
-    }
-    if user_id not in measurements:
-        measurements[user_id] = []
-    measurements[user_id].append(entry)
-    # Сохраняем данные в Firebase
-    save_data(users, measurements, reminder_settings)
+    series = measurements.setdefault(user_id, MeasurementSeries())
+    series.append(datetime.now(TIMEZONE).replace(tzinfo=None), parse_pressure(first), (sys, dia))
+    # Сохраняем данные (журнал → Firebase)
+    record_change(f"measurements/{user_id}/{len(series) - 1}", series.entry(-1))
     try:
         await message.answer(f"Записал! Первое: {first}, Второе: {pressure}. Что дальше? ❤️",
                              reply_markup=get_main_menu())
+        # Мгновенная локальная сводка, ChatGPT получает только её
+        summary = analyze_measurements(series, measurement_aggregates.get(user_id))
+        await message.answer(format_analysis_summary(summary))
         # Анализ через ChatGPT
-        prompt = generate_analysis_prompt(users[user_id], entry, measurements[user_id])
+        prompt = generate_analysis_prompt(users[user_id], summary)
         try:
             client = OpenAI(api_key=OPENAI_API_KEY)
             response = client.chat.completions.create(
@@ -493,19 +1104,51 @@ async def show_history(message: types.Message):
     if user_id not in users:
         await message.answer("Сначала зарегистрируйся! Напиши /start.")
         return
-    user_measurements = measurements.get(user_id, [])
-    logging.info(f"User {user_id} measurements: {user_measurements}")
-    if not user_measurements:
+    user_measurements = measurements.get(user_id, MeasurementSeries())
+    user_aggregates = measurement_aggregates.get(user_id, {})
+    logging.info(f"User {user_id} measurements: {len(user_measurements)}")
+    if not user_measurements and not user_aggregates:
         await message.answer("У тебя пока нет измерений. Давай измерим давление? ❤️")
         return
     history_text = "📜 Твоя история измерений:\n\n"
-    for entry in user_measurements:
+    if user_aggregates:
+        history_text += "🗓 Ранее, по месяцам:\n"
+        for month, aggregate in sorted(user_aggregates.items()):
+            history_text += (
+                f"{format_month(month)}: {aggregate['count']} изм., среднее "
+                f"{round(aggregate['sys_mean'])}/{round(aggregate['dia_mean'])}, "
+                f"систолическое {aggregate['sys_min']:g}-{aggregate['sys_max']:g}\n"
+            )
+        history_text += "\n"
+    for entry in user_measurements.entries():
         history_text += f"Дата: {entry['date']}\nПервое: {entry['first']}\nВторое: {entry['second']}\n\n"
     try:
         await message.answer(history_text)
     except TelegramForbiddenError:
         logging.warning(f"Bot was blocked by user {user_id}")
 
+# График давления
+@dp.message(lambda message: message.text == "График")
+async def show_chart(message: types.Message):
+    user_id = message.from_user.id
+    if user_id not in users:
+        await message.answer("Сначала зарегистрируйся! Напиши /start.")
+        return
+    if not measurements.get(user_id) and not measurement_aggregates.get(user_id):
+        await message.answer("У тебя пока нет измерений. Давай измерим давление? ❤️")
+        return
+    try:
+        png = await get_pressure_chart(user_id)
+        if png is None:
+            await message.answer("Сейчас строится много графиков. Попробуй через минуту.")
+            return
+        await message.answer_photo(types.BufferedInputFile(png, filename=f"chart_{user_id}.png"))
+    except TelegramForbiddenError:
+        logging.warning(f"Bot was blocked by user {user_id}")
+    except Exception as e:
+        logging.error(f"Ошибка построения графика: {e}")
+        await message.answer("Не удалось построить график. Попробуй позже.")
+
 # Экспорт данных
 @dp.message(lambda message: message.text == "Экспорт данных")
 async def export_data(message: types.Message):
@@ -513,21 +1156,121 @@ async def export_data(message: types.Message):
     if user_id not in users:
         await message.answer("Сначала зарегистрируйся! Напиши /start.")
         return
-    user_measurements = measurements.get(user_id, [])
-    if not user_measurements:
+    user_measurements = measurements.get(user_id, MeasurementSeries()).entries()
+    user_aggregates = measurement_aggregates.get(user_id, {})
+    if not user_measurements and not user_aggregates:
         await message.answer("У тебя пока нет данных для экспорта. Давай измерим давление? ❤️")
         return
-    df = pd.DataFrame(user_measurements)
+    archive_missing = False
+    if ARCHIVE_COMPACTED:
+        # Архив загружается только по запросу экспорта; без Firebase выгружаем то, что есть
+        try:
+            archive = await asyncio.to_thread(db.reference(f'measurement_archive/{user_id}').get) or {}
+            user_measurements = [archive[key] for key in sorted(archive)] + user_measurements
+        except Exception as e:
+            logging.warning(f"Failed to load measurement archive of user {user_id}: {e}")
+            archive_missing = True
     filename = f"measurements_{user_id}.xlsx"
-    df.to_excel(filename, index=False)
+    with pd.ExcelWriter(filename) as writer:
+        pd.DataFrame(user_measurements, columns=["date", "first", "second"]).to_excel(
+            writer, sheet_name="Измерения", index=False
+        )
+        if user_aggregates:
+            df_months = pd.DataFrame(
+                [{"month": format_month(month), **aggregate} for month, aggregate in sorted(user_aggregates.items())]
+            )
+            df_months.to_excel(writer, sheet_name="По месяцам", index=False)
     try:
         with open(filename, "rb") as file:
             await message.answer_document(types.BufferedInputFile(file.read(), filename=filename))
-        await message.answer("📤 Данные экспортированы в Excel!")
+        if archive_missing:
+            await message.answer(
+                "📤 Данные экспортированы в Excel, но старые измерения из архива сейчас недоступны — "
+                "в файле их нет. Попробуй экспорт позже."
+            )
+        else:
+            await message.answer("📤 Данные экспортированы в Excel!")
         os.remove(filename)
     except TelegramForbiddenError:
         logging.warning(f"Bot was blocked by user {user_id}")
 
+# Импорт данных
+@dp.message(lambda message: message.text == "Импорт данных")
+async def import_data(message: types.Message, state: FSMContext):
+    user_id = message.from_user.id
+    if user_id not in users:
+        await message.answer("Сначала зарегистрируйся! Напиши /start.")
+        return
+    try:
+        await message.answer(
+            "Пришли файл CSV или XLSX с колонками date, first, second — как в экспорте данных. "
+            "Дата в формате ДД.ММ.ГГГГ ЧЧ:ММ, давление в формате 120/80. "
+            "Если в строке одно измерение, колонку second можно оставить пустой.",
+            reply_markup=ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="Отмена")]], resize_keyboard=True)
+        )
+        await state.set_state(ImportData.file)
+    except TelegramForbiddenError:
+        logging.warning(f"Bot was blocked by user {user_id}")
+
+# Обработка файла для импорта
+@dp.message(ImportData.file)
+async def process_import_file(message: types.Message, state: FSMContext):
+    user_id = message.from_user.id
+    if message.text == "Отмена":
+        await message.answer("Импорт отменён.", reply_markup=get_main_menu())
+        await state.clear()
+        return
+    document = message.document
+    if document is None or not (document.file_name or "").lower().endswith((".csv", ".xlsx")):
+        await message.answer("Пришли файл в формате CSV или XLSX.")
+        return
+    await state.clear()
+    try:
+        progress = await message.answer("⏳ Читаю файл...", reply_markup=get_main_menu())
+        content = (await bot.download(document)).read()
+        existing_dates, closed_months = await asyncio.to_thread(get_import_conflicts, user_id)
+        now = datetime.now(TIMEZONE).replace(tzinfo=None)
+        cutoff = now - timedelta(days=RAW_HISTORY_DAYS)
+        try:
+            accepted, errors = await asyncio.to_thread(
+                parse_import_file, content, document.file_name, existing_dates, closed_months, cutoff, now
+            )
+        except Exception as e:
+            logging.warning(f"Failed to parse import file of user {user_id}: {e}")
+            await progress.edit_text(f"Не удалось прочитать файл: {e}")
+            return
+
+        if accepted:
+            series = measurements.setdefault(user_id, MeasurementSeries())
+            first_changed = series.merge(accepted)
+            # Старые строки сразу сворачиваются в агрегаты; иначе дописываем изменившийся хвост пачками
+            if not compact_user_history(user_id):
+                for start in range(first_changed, len(series), IMPORT_BATCH_SIZE):
+                    stop = min(start + IMPORT_BATCH_SIZE, len(series))
+                    record_change(
+                        f"measurements/{user_id}", {str(i): series.entry(i) for i in range(start, stop)}, op="update"
+                    )
+                    await progress.edit_text(
+                        f"⏳ Сохранено {stop - first_changed} из {len(series) - first_changed}..."
+                    )
+
+        report = f"📥 Импорт завершён: добавлено {len(accepted)}, пропущено {len(errors)}."
+        if errors:
+            report += "\n\n" + "\n".join(errors[:IMPORT_ERRORS_IN_MESSAGE])
+            if len(errors) > IMPORT_ERRORS_IN_MESSAGE:
+                report += f"\n...и ещё {len(errors) - IMPORT_ERRORS_IN_MESSAGE}, полный список в файле."
+        await progress.edit_text(report)
+        if len(errors) > IMPORT_ERRORS_IN_MESSAGE:
+            await message.answer_document(
+                types.BufferedInputFile("\n".join(errors).encode("utf-8"), filename="import_errors.txt")
+            )
+        if accepted:
+            summary = analyze_measurements(measurements[user_id], measurement_aggregates.get(user_id))
+            if summary:
+                await message.answer(format_analysis_summary(summary))
+    except TelegramForbiddenError:
+        logging.warning(f"Bot was blocked by user {user_id}")
+
 # Установить напоминания
 @dp.message(lambda message: message.text == "Установить напоминания")
 async def set_reminders(message: types.Message, state: FSMContext):
@@ -563,9 +1306,10 @@ async def process_reminder_time(message: types.Message, state: FSMContext):
         except ValueError:
             await message.answer(f"Некорректное время: {t}. Часы: 0-23, минуты: 0-59.")
             return
-    reminder_settings[user_id] = {"times": valid_times, "active": True}
-    # Сохраняем данные в Firebase
-    save_data(users, measurements, reminder_settings)
+    reminder_settings[user_id] = ReminderSettings(times=tuple(valid_times), active=True)
+    # Сохраняем данные (журнал → Firebase)
+    record_change(f"reminder_settings/{user_id}", reminder_settings[user_id].to_json())
+    update_reminder_index(user_id)
     try:
         await message.answer(f"Напоминания установлены на: {', '.join(valid_times)}", reply_markup=get_main_menu())
         await state.clear()
@@ -579,10 +1323,11 @@ async def disable_reminders(message: types.Message):
     if user_id not in users:
         await message.answer("Сначала зарегистрируйся! Напиши /start.")
         return
-    reminder_settings[user_id] = reminder_settings.get(user_id, {})
-    reminder_settings[user_id]["active"] = False
-    # Сохраняем данные в Firebase
-    save_data(users, measurements, reminder_settings)
+    settings = reminder_settings.setdefault(user_id, ReminderSettings())
+    settings.active = False
+    # Сохраняем данные (журнал → Firebase)
+    record_change(f"reminder_settings/{user_id}", settings.to_json())
+    update_reminder_index(user_id)
     try:
         await message.answer("⛔ Напоминания отключены! Включи снова, когда будет нужно.", reply_markup=get_main_menu())
     except TelegramForbiddenError:
@@ -612,8 +1357,11 @@ async def process_edit_field(message: types.Message, state: FSMContext):
         await state.clear()
         return
     if field == "Сбросить историю измерений":
-        measurements[user_id] = []
-        save_data(users, measurements, reminder_settings)
+        measurements[user_id] = MeasurementSeries()
+        measurement_aggregates.pop(user_id, None)
+        record_change(f"measurements/{user_id}", None)
+        record_change(f"measurement_aggregates/{user_id}", None)
+        record_change(f"measurement_archive/{user_id}", None)
         await message.answer("История измерений сброшена.", reply_markup=get_main_menu())
         await state.clear()
         return
@@ -667,8 +1415,8 @@ async def process_new_value(message: types.Message, state: FSMContext):
                 await message.answer("Вес должен быть числом от 20 до 300 кг!")
                 return
 
-        users[user_id][field] = value
-        save_data(users, measurements, reminder_settings)
+        setattr(users[user_id], PROFILE_FIELDS[field], value)
+        record_change(f"users/{user_id}", users[user_id].to_json())
         await message.answer(f"{field.capitalize()} обновлено: {value}.", reply_markup=get_main_menu())
         await state.clear()
     except ValueError:
@@ -741,6 +1489,153 @@ async def handle_ai_chat(message: types.Message, state: FSMContext):
     except TelegramForbiddenError:
         logging.warning(f"Bot was blocked by user {user_id}")
 
+# 🔄 Применение изменений, сделанных вне этого процесса (админка, другой инстанс бота)
+sync_tasks = set()
+
+async def fetch_remote_user(node, user_id):
+    try:
+        data = await asyncio.to_thread(db.reference(f"{node}/{user_id}").get)
+    except Exception as e:
+        logging.warning(f"Failed to fetch {node}/{user_id}: {e}")
+        return
+    apply_remote_event(node, "put", f"/{user_id}", data)
+
+def _apply_remote_put(node, user_id, data):
+    cache = get_cache(node)
+    if data is None:
+        cache.pop(user_id, None)
+        return
+    try:
+        cache[user_id] = cache_from_json(node, data)
+    except Exception as e:
+        logging.error(f"🚨 Ignored unreadable remote record {node}/{user_id}: {e!r}")
+
+def apply_remote_event(node, event_type, path, data):
+    keys = [part for part in path.split("/") if part]
+    if not keys:
+        # Событие на весь узел: put заменяет его целиком, patch — отдельных пользователей
+        if event_type == "put":
+            remote = data or {}
+            changed = set(get_cache(node)) | {int(k) for k in remote}
+            updates = {user_id: remote.get(str(user_id)) for user_id in changed}
+        else:
+            updates = {int(k): v for k, v in (data or {}).items()}
+        changed_users = []
+        for user_id, value in updates.items():
+            if has_pending_change(f"{node}/{user_id}"):
+                continue  # локальная версия новее, она ещё в журнале
+            _apply_remote_put(node, user_id, value)
+            changed_users.append(user_id)
+    else:
+        user_id = int(keys[0])
+        if has_pending_change(f"{node}/{user_id}"):
+            return
+        if user_id not in get_cache(node) and (event_type == "patch" or len(keys) > 1):
+            # Частичное изменение неизвестного пользователя: сначала загружаем запись целиком
+            task = asyncio.create_task(fetch_remote_user(node, user_id))
+            sync_tasks.add(task)
+            task.add_done_callback(sync_tasks.discard)
+            return
+        apply_change_to_cache("update" if event_type == "patch" else "set", f"{node}{path}", data)
+        changed_users = [user_id]
+    if node == "reminder_settings":
+        for user_id in changed_users:
+            update_reminder_index(user_id)
+    logging.info(f"Synced {event_type} {node}{path} for {len(changed_users)} users")
+
+# Realtime-подписка: первое событие каждого узла — его полный снимок, он и заполняет кэш
+async def start_listeners():
+    loop = asyncio.get_running_loop()
+    snapshots = {node: loop.create_future() for node in SYNCED_NODES}
+
+    def on_event(node, event_type, path, data):
+        snapshot = snapshots[node]
+        if not snapshot.done() and event_type == "put" and path == "/":
+            load_node_snapshot(node, data)
+            snapshot.set_result(None)
+            return
+        apply_remote_event(node, event_type, path, data)
+
+    for node in SYNCED_NODES:
+        # Колбэк вызывается из потока firebase_admin, изменения применяются в цикле бота
+        db.reference(node).listen(
+            lambda event, node=node: loop.call_soon_threadsafe(on_event, node, event.event_type, event.path, event.data)
+        )
+    try:
+        await asyncio.wait_for(asyncio.gather(*snapshots.values()), SYNC_SNAPSHOT_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.error("Timed out waiting for Firebase listener snapshots, loading data directly")
+        for snapshot in snapshots.values():
+            if not snapshot.done():
+                snapshot.set_result(None)  # опоздавший снимок применится как обычное событие
+        fill_caches(await asyncio.to_thread(load_data))
+        return
+    finish_cache_load()
+
+# Опрос: один условный запрос по ETag на весь узел, изменившихся пользователей находим сами.
+# Вместо копии узла храним хэш JSON каждого пользователя
+def remote_user_hashes(data):
+    return {int(key): hash(json.dumps(value, sort_keys=True)) for key, value in (data or {}).items() if value is not None}
+
+def fetch_node_if_changed(ref, etag):
+    if etag is None:
+        data, etag = ref.get(etag=True)
+        changed = True
+    else:
+        changed, data, etag = ref.get_if_changed(etag)
+    return changed, data, etag, remote_user_hashes(data) if changed else None
+
+# Каждые SYNC_POLL_SECONDS; применяются только пользователи, чей хэш изменился
+async def sync_poll_loop(node, etag, hashes):
+    ref = db.reference(node)
+    while True:
+        await asyncio.sleep(SYNC_POLL_SECONDS)
+        try:
+            changed, data, new_etag, new_hashes = await asyncio.to_thread(fetch_node_if_changed, ref, etag)
+        except Exception as e:
+            logging.warning(f"Failed to poll {node}: {e}")
+            continue
+        if not changed:
+            continue
+        remote = data or {}
+        skipped = False
+        for user_id in set(hashes) | set(new_hashes):
+            if hashes.get(user_id) == new_hashes.get(user_id):
+                continue
+            if has_pending_change(f"{node}/{user_id}"):
+                skipped = True  # локальная версия новее; узел перечитаем на следующем опросе
+                continue
+            apply_remote_event(node, "put", f"/{user_id}", remote.get(str(user_id)))
+            if user_id in new_hashes:
+                hashes[user_id] = new_hashes[user_id]
+            else:
+                hashes.pop(user_id, None)
+        if not skipped:
+            etag = new_etag
+
+async def start_polling_sync():
+    etags, hashes = {}, {}
+    try:
+        for node in SYNCED_NODES:
+            _, data, etags[node], hashes[node] = await asyncio.to_thread(fetch_node_if_changed, db.reference(node), None)
+            load_node_snapshot(node, data)
+    except Exception as e:
+        logging.error(f"Failed to load data for polling, loading it directly: {e}")
+        fill_caches(await asyncio.to_thread(load_data))
+        etags, hashes = {}, {}  # первый опрос скачает узлы целиком и сравнит с пустыми хэшами
+    else:
+        finish_cache_load()
+    for node in SYNCED_NODES:
+        asyncio.create_task(sync_poll_loop(node, etags.get(node), hashes.get(node, {})))
+
+# Заполняет кэши и запускает синхронизацию; до её завершения бот не принимает сообщения
+async def start_sync():
+    if SYNC_MODE == "listen":
+        await start_listeners()
+    elif SYNC_MODE == "poll":
+        await start_polling_sync()
+    logging.info(f"Firebase sync mode: {SYNC_MODE}, users loaded: {len(users)}")
+
 # Цикл для напоминаний
 async def reminder_loop():
     logging.info("Starting reminder loop")
@@ -749,29 +1644,21 @@ async def reminder_loop():
         current_time = now.strftime("%H:%M")
         current_date = now.strftime("%d.%m.%Y")
         logging.info(f"Checking reminders at {current_time}")
-        for user_id, settings in reminder_settings.items():
-            logging.info(f"User {user_id} settings: {settings}")
-            if not settings.get("active", False):
-                logging.info(f"Reminders for user {user_id} are not active")
-                continue
-            times = settings.get("times", [])
-            if current_time in times:
-                logging.info(f"Found matching time {current_time} for user {user_id}")
-                user_measurements = measurements.get(user_id, [])
-                measured_today = any(
-                    entry["date"].startswith(current_date)
-                    for entry in user_measurements
-                )
-                if measured_today:
+        for user_id in list(reminder_index.get(current_time, ())):
+            logging.info(f"Found matching time {current_time} for user {user_id}")
+            try:
+                user_measurements = measurements.get(user_id)
+                # Измерения хранятся по порядку дат, достаточно проверить последнее
+                last_date = user_measurements.last_date() if user_measurements else None
+                if last_date and last_date.strftime("%d.%m.%Y") == current_date:
                     logging.info(f"User {user_id} already measured today")
                     continue
-                try:
-                    await bot.send_message(user_id, "⏰ Напоминание: пора измерить давление!")
-                    logging.info(f"Sent reminder to user {user_id} at {current_time}")
-                except TelegramForbiddenError:
-                    logging.warning(f"Bot was blocked by user {user_id}")
-                except Exception as e:
-                    logging.warning(f"Failed to send reminder to user {user_id}: {e}")
+                await bot.send_message(user_id, "⏰ Напоминание: пора измерить давление!")
+                logging.info(f"Sent reminder to user {user_id} at {current_time}")
+            except TelegramForbiddenError:
+                logging.warning(f"Bot was blocked by user {user_id}")
+            except Exception as e:
+                logging.warning(f"Failed to send reminder to user {user_id}: {e}")
         await asyncio.sleep(60)
 
 # Запуск бота
@@ -800,7 +1687,10 @@ async def main():
                 raise
             await asyncio.sleep(5)
 
+    await start_sync()
+    asyncio.create_task(journal_replayer())
     asyncio.create_task(reminder_loop())
+    asyncio.create_task(compaction_loop())
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+import json
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+from models import DATE_FORMAT, MeasurementSeries, ReminderSettings, UserProfile
+
+# 📏 Сравнение памяти: данные пользователей в виде словарей из Firebase и в виде моделей из models.py
+# Запуск: python memory_benchmark.py [пользователей] [измерений на пользователя]
+
+
+def make_firebase_data(user_count, readings_per_user):
+    random.seed(1)
+    start = datetime(2024, 1, 1)
+    users, measurements, reminders = {}, {}, {}
+    for user_id in range(user_count):
+        users[str(user_id)] = {"name": f"Пользователь {user_id}", "age": 55, "gender": "Женский", "height": 165, "weight": 70}
+        measurements[str(user_id)] = [
+            {
+                "date": (start + timedelta(hours=12 * i, minutes=random.randint(0, 59))).strftime(DATE_FORMAT),
+                "first": f"{random.randint(110, 160)}/{random.randint(70, 100)}",
+                "second": f"{random.randint(110, 160)}/{random.randint(70, 100)}",
+            }
+            for i in range(readings_per_user)
+        ]
+        reminders[str(user_id)] = {"times": ["09:00", "21:00"], "active": True}
+    # Как при загрузке из Firebase: каждая строка — отдельный объект
+    return json.dumps({"users": users, "measurements": measurements, "reminder_settings": reminders})
+
+
+def load_dicts(raw):
+    data = json.loads(raw)
+    return (
+        {int(k): v for k, v in data["users"].items()},
+        {int(k): v for k, v in data["measurements"].items()},
+        {int(k): v for k, v in data["reminder_settings"].items()},
+    )
+
+
+def load_models(raw):
+    data = json.loads(raw)
+    return (
+        {int(k): UserProfile.from_json(v) for k, v in data["users"].items()},
+        {int(k): MeasurementSeries.from_json(v) for k, v in data["measurements"].items()},
+        {int(k): ReminderSettings.from_json(v) for k, v in data["reminder_settings"].items()},
+    )
+
+
+def measure(loader, raw):
+    tracemalloc.start()
+    result = loader(raw)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, result
+
+
+def main():
+    user_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    readings_per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 180
+    raw = make_firebase_data(user_count, readings_per_user)
+
+    dict_size, _ = measure(load_dicts, raw)
+    model_size, _ = measure(load_models, raw)
+
+    print(f"Пользователей: {user_count}, измерений на пользователя: {readings_per_user}")
+    print(f"Словари:  {dict_size / 1024 / 1024:8.1f} МБ, {dict_size / user_count:9.0f} байт на пользователя")
+    print(f"Модели:   {model_size / 1024 / 1024:8.1f} МБ, {model_size / user_count:9.0f} байт на пользователя")
+    print(f"Экономия: {dict_size / model_size:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
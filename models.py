@@ -0,0 +1,253 @@
+import re
+from array import array
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+# 🧱 Компактная модель данных: профили, настройки напоминаний и измерения давления.
+# Конвертируется в формат Firebase (to_json) и обратно (from_json).
+
+DATE_FORMAT = "%d.%m.%Y %H:%M"
+EPOCH = datetime(1970, 1, 1)
+
+# Ключи, которые раньше записывало редактирование профиля, -> поля профиля
+PROFILE_FIELDS = {"имя": "name", "возраст": "age", "пол": "gender", "рост": "height", "вес": "weight"}
+
+
+def parse_pressure(pressure):
+    sys, dia = map(int, pressure.split("/"))
+    return sys, dia
+
+
+# Дата хранится как число минут от 01.01.1970 (московское время, без часового пояса)
+def to_minutes(date):
+    return (date - EPOCH) // timedelta(minutes=1)
+
+
+def from_minutes(minutes):
+    return EPOCH + timedelta(minutes=minutes)
+
+
+# Числа из профиля могли быть записаны как строки вроде "30 лет"; без числа — 0
+def parse_profile_number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    match = re.search(r"\d+", str(value))
+    return int(match.group()) if match else 0
+
+
+# Колонки MeasurementSeries: минуты в array("i"), показания в array("H")
+MINUTES_RANGE = range(-2**31, 2**31)
+PRESSURE_RANGE = range(0, 2**16)
+ENTRY_ERRORS = (KeyError, TypeError, ValueError, AttributeError, OverflowError)
+
+
+# Проверка до записи в колонки, чтобы неудачная запись не сдвинула одну колонку относительно другой
+def check_row(minutes, values):
+    if minutes not in MINUTES_RANGE or any(value not in PRESSURE_RANGE for value in values):
+        raise ValueError(f"measurement out of range: {minutes}, {values}")
+    return minutes, values
+
+
+# Разбирает измерение из Firebase в (минуты, показания)
+def parse_entry(entry):
+    values = (*parse_pressure(entry["first"]), *parse_pressure(entry["second"]))
+    return check_row(to_minutes(datetime.strptime(entry["date"], DATE_FORMAT)), values)
+
+
+# 👤 Профиль пользователя
+@dataclass(slots=True)
+class UserProfile:
+    name: str
+    age: int
+    gender: str
+    height: int
+    weight: int
+
+    @classmethod
+    def from_json(cls, data):
+        data = dict(data)
+        # Значения под русскими ключами записаны позже, они важнее
+        for legacy_key, field in PROFILE_FIELDS.items():
+            if legacy_key in data:
+                data[field] = data[legacy_key]
+        return cls(
+            name=str(data.get("name", "")),
+            age=parse_profile_number(data.get("age", 0)),
+            gender=str(data.get("gender", "")),
+            height=parse_profile_number(data.get("height", 0)),
+            weight=parse_profile_number(data.get("weight", 0)),
+        )
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "age": self.age,
+            "gender": self.gender,
+            "height": self.height,
+            "weight": self.weight,
+        }
+
+
+# ⏰ Настройки напоминаний
+@dataclass(slots=True)
+class ReminderSettings:
+    times: tuple = ()
+    active: bool = False
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(times=tuple(data.get("times") or ()), active=bool(data.get("active", False)))
+
+    def to_json(self):
+        return {"times": list(self.times), "active": self.active}
+
+
+# 📈 Измерения пользователя: колонка дат и колонка показаний (4 числа на измерение).
+# Индексы совпадают с индексами списка в Firebase: пропуски и нераспознанные записи хранятся
+# как есть (raw) на своих местах, в расчётах они не участвуют, но и не теряются при записи.
+class MeasurementSeries:
+    __slots__ = ("timestamps", "values", "raw")
+
+    def __init__(self):
+        self.timestamps = array("i")
+        self.values = array("H")  # сист./диаст. первого замера, сист./диаст. второго
+        self.raw = {}  # индекс -> исходное значение из Firebase для пропусков и нераспознанных записей
+
+    @classmethod
+    def from_json(cls, data):
+        series = cls()
+        if isinstance(data, dict):  # Firebase отдаёт список с пропусками как словарь
+            size = max(map(int, data), default=-1) + 1
+            data = [data.get(str(i)) for i in range(size)]
+        for entry in data or ():
+            series.append_entry(entry)
+        return series
+
+    def to_json(self):
+        return [self.entry(i) for i in range(len(self))]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _append_row(self, minutes, values, raw=None, is_raw=False):
+        if is_raw:
+            self.raw[len(self.timestamps)] = raw
+        self.timestamps.append(minutes)
+        self.values.extend(values)
+
+    # Запись, которую не удалось разобрать: дата берётся у предыдущей, чтобы не нарушать порядок
+    def _append_placeholder(self, entry):
+        minutes = self.timestamps[-1] if self.timestamps else 0
+        self._append_row(minutes, (0, 0, 0, 0), entry, is_raw=True)
+
+    def append(self, date, first, second):
+        self._append_row(*check_row(to_minutes(date), (*first, *second)))
+
+    def append_entry(self, entry):
+        try:
+            minutes, values = parse_entry(entry)
+        except ENTRY_ERRORS:
+            self._append_placeholder(entry)
+            return
+        self._append_row(minutes, values)
+
+    def set_entry(self, index, entry):
+        if index == len(self):
+            self.append_entry(entry)
+            return
+        try:
+            minutes, values = parse_entry(entry)
+        except ENTRY_ERRORS:
+            self.raw[index] = entry
+            return
+        self.raw.pop(index, None)
+        self.timestamps[index] = minutes
+        self.values[index * 4:index * 4 + 4] = array("H", values)
+
+    def date(self, index):
+        return from_minutes(self.timestamps[index])
+
+    def last_date(self):
+        for i in range(len(self) - 1, -1, -1):
+            if i not in self.raw:
+                return self.date(i)
+        return None
+
+    # Даты распознанных измерений в минутах
+    def valid_timestamps(self):
+        return {minutes for i, minutes in enumerate(self.timestamps) if i not in self.raw}
+
+    # Измерение в формате Firebase: {"date": ..., "first": "120/80", "second": "118/79"}
+    def entry(self, index):
+        if index < 0:
+            index += len(self)
+        if index in self.raw:
+            return self.raw[index]
+        sys_first, dia_first, sys_second, dia_second = self.values[index * 4:index * 4 + 4]
+        return {
+            "date": self.date(index).strftime(DATE_FORMAT),
+            "first": f"{sys_first}/{dia_first}",
+            "second": f"{sys_second}/{dia_second}",
+        }
+
+    # Только распознанные измерения, начиная с индекса start
+    def entries(self, start=0):
+        if start < 0:
+            start = max(len(self) + start, 0)
+        return [self.entry(i) for i in range(start, len(self)) if i not in self.raw]
+
+    # Усреднённые пары замеров: (дата, сист., диаст., разница сист., разница диаст.)
+    def readings(self):
+        values = self.values
+        for i, minutes in enumerate(self.timestamps):
+            if i in self.raw:
+                continue
+            sys_first, dia_first, sys_second, dia_second = values[i * 4:i * 4 + 4]
+            yield (
+                from_minutes(minutes),
+                (sys_first + sys_second) / 2,
+                (dia_first + dia_second) / 2,
+                abs(sys_first - sys_second),
+                abs(dia_first - dia_second),
+            )
+
+    # Строки (минуты, показания, исходное значение или None, признак raw)
+    def _rows(self):
+        return [
+            (minutes, self.values[i * 4:i * 4 + 4], self.raw.get(i), i in self.raw)
+            for i, minutes in enumerate(self.timestamps)
+        ]
+
+    def _load_rows(self, rows):
+        self.timestamps, self.values, self.raw = array("i"), array("H"), {}
+        for minutes, values, raw, is_raw in rows:
+            self._append_row(minutes, values, raw, is_raw)
+
+    # Делит измерения по дате: (до cutoff, начиная с cutoff). Нераспознанные записи остаются
+    # в новой части, пропуски отбрасываются — новая часть записывается в Firebase целиком
+    def split_before(self, cutoff):
+        cutoff = to_minutes(cutoff)
+        older, newer = MeasurementSeries(), MeasurementSeries()
+        older_rows, newer_rows = [], []
+        for row in self._rows():
+            minutes, _, raw, is_raw = row
+            if is_raw:
+                if raw is not None:
+                    newer_rows.append(row)
+            elif minutes < cutoff:
+                older_rows.append(row)
+            else:
+                newer_rows.append(row)
+        older._load_rows(older_rows)
+        newer._load_rows(newer_rows)
+        return older, newer
+
+    # Вливает новые измерения с сохранением порядка дат, возвращает индекс первого изменившегося
+    def merge(self, other):
+        old_rows = self._rows()
+        rows = sorted(old_rows + other._rows(), key=lambda row: row[0])
+        first_changed = next(
+            (i for i, (old, new) in enumerate(zip(old_rows, rows)) if old is not new), len(old_rows)
+        )
+        self._load_rows(rows)
+        return first_changed